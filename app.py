@@ -1,46 +1,109 @@
+from __future__ import annotations
+
+import atexit
 import logging
 from http import HTTPStatus
+from typing import TYPE_CHECKING
 
+import orjson
 from flask import Flask, request
+from flask_compress import Compress
+from werkzeug.exceptions import HTTPException
 
 from to_do_api.audit_logging import HTTPAuditLogger
-from to_do_api.service.user import UserService
-from to_do_api.utils import response_with_status, success_response
+from to_do_api.log_formatter import JSON_FORMATTER
+from to_do_api.service.user import InvalidUserError, UserService
+from to_do_api.utils import ORJSONProvider, json_bytes_response, json_stream_response, response_with_status
+
+if TYPE_CHECKING:
+    import typing as t
 
-__LOG_FMT = "{\"time\": \"%(asctime)s\", \"name\": \"[%(name)s]\", \"filename\": \"[%(filename)s]\", \"lineno\": \"[%(lineno)s]\", \"levelname\": \"%(levelname)s\", \"message\": \"%(message)s\"}"
+    from to_do_api.models import User
 
 application = Flask(__name__)
+application.json = ORJSONProvider(application)
+application.config.update(
+    COMPRESS_MIN_SIZE=500,
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    # flask-compress buffers streamed responses to compress them, these are compressed while streaming instead
+    COMPRESS_STREAMS=False,
+)
+Compress(application)
+user_service = UserService()
 audit_logger = HTTPAuditLogger.from_env()
 audit_logger.start()
+# the writer is a daemon thread: flush the queued records before the process (or gunicorn worker) exits
+atexit.register(audit_logger.stop)
 
 
-logging.basicConfig(level=logging.INFO, format=__LOG_FMT)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JSON_FORMATTER)
+logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+# JSONFormatter doesn't output thread/process information, don't collect it for every record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 root_logger = logging.getLogger()
 
 
-@application.route("/users", methods=['GET', 'POST'])
+def _users_json(users: t.Iterable[User]) -> t.Iterator[bytes]:
+    """
+    Yield the users list response piece by piece, so it is sent while the rows are still being read
+    """
+    yield b'{"Result":['
+    first = True
+    for user in users:
+        if not first:
+            yield b','
+        first = False
+        yield user.to_json_bytes()
+    yield b']}'
+
+
+@application.get("/users")
+@audit_logger.log_inbound(include_request_in_response=False)
+def list_users():
+    if root_logger.isEnabledFor(logging.DEBUG):
+        root_logger.debug("%s - %s", request.path, request.method)
+
+    response = user_service.list_users()
+
+    return json_stream_response(_users_json(response))
+
+
+@application.post("/users")
 @audit_logger.log_inbound(include_request_in_response=False)
-def users():
-    root_logger.debug(f"{request.path} - {request.method}")
-    try:
-        user_service = UserService()
-        if request.method == "POST":
-            user = request.get_json()
-            response = user_service.insert_user(user)
+def insert_user():
+    if root_logger.isEnabledFor(logging.DEBUG):
+        root_logger.debug("%s - %s", request.path, request.method)
+
+    user = orjson.loads(request.get_data())
+    response = user_service.insert_user(user)
+
+    return json_bytes_response(b'{"Result":' + response.to_json_bytes() + b'}')
+
+
+@application.errorhandler(orjson.JSONDecodeError)
+def invalid_json(ex: orjson.JSONDecodeError):
+    return response_with_status(ex, HTTPStatus.BAD_REQUEST)
+
 
-            # make json serializable
-            response = response.__dict__
-        elif request.method == "GET":
-            response = user_service.list_users()
+@application.errorhandler(InvalidUserError)
+def invalid_user(ex: InvalidUserError):
+    return response_with_status(ex, HTTPStatus.BAD_REQUEST)
 
-            # make json serializable
-            response = [user.__dict__ for user in response]
 
-        return success_response({"Result": response})
-    except Exception as ex:
-        return response_with_status(ex, HTTPStatus.INTERNAL_SERVER_ERROR)
+@application.errorhandler(Exception)
+def unexpected_error(ex: Exception):
+    # HTTP errors (404, 405...) keep their own status
+    if isinstance(ex, HTTPException):
+        return ex
+    # Flask doesn't log errors that have a handler; the message may expose internal details (e.g. database hosts)
+    application.log_exception((type(ex), ex, ex.__traceback__))
+    return response_with_status("Internal Server Error", HTTPStatus.INTERNAL_SERVER_ERROR)
 
 
 if __name__ == "__main__":
+    # Development server only, the application is served by gunicorn (see gunicorn.conf.py)
     root_logger.info("*** APPLICATION NAME %s", application.name)
-    application.run(host="0.0.0.0", port=8000)
\ No newline at end of file
+    application.run(host="0.0.0.0", port=8000, threaded=True)
\ No newline at end of file
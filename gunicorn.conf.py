@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+# Loaded automatically by gunicorn when started from the project root, e.g. `gunicorn` or `make serve`.
+
+wsgi_app = "app:application"
+bind = os.getenv("GUNICORN_BIND", ":8000")
+
+# gthread workers keep client connections alive between requests and handle them with a thread pool,
+# one worker process per core (plus one) uses all the cores.
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() + 1))
+# each thread may hold a database connection for a whole request (GET /users streams its rows), and the pool raises
+# PoolError instead of waiting when it runs out: keep GUNICORN_THREADS <= DB_POOL_MAX.
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# heartbeat files in memory instead of the container's disk, where there is one (not on e.g. macOS)
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+errorlog = "-"
+
+# Do not preload the app: the audit logger thread is started at import time and would not survive the fork.
+preload_app = False
@@ -0,0 +1,211 @@
+import io
+
+import msgpack
+import orjson
+import pytest
+import zstandard
+from to_do_api.audit_logging import HTTPAuditLogger, Options
+
+@pytest.fixture()
+def audit_logger(mocker):
+    opts = Options(s3_bucket="audit-test", s3_directory="todo-api/", s3_region="us-east-1",
+                   queue_max=2, buffer_size=2, buffer_time=0)
+    audit_logger = HTTPAuditLogger(opts=opts)
+
+    yield audit_logger
+
+@pytest.mark.usefixtures("audit_logger")
+def test_queue_record(mocker, audit_logger):
+    written = []
+    mocker.patch("to_do_api.audit_logging.http_audit_logger.HTTPAuditLogger._do_s3_write",
+                 lambda p1, p2: written.append(p2))
+
+    # test records are queued for the writer thread
+    audit_logger._queue_record("id1", {}, None)
+    audit_logger._queue_record("id2", {}, None)
+
+    assert written == []
+    assert audit_logger.queue.qsize() == 2
+
+    # test full queue falls back to a synchronous write
+    audit_logger._queue_record("id3", {}, None)
+
+    assert len(written) == 1
+    assert [record.data["identifier"] for record in written[0]] == ["id3"]
+
+    # test the writer drains up to buffer_size records at once
+    batch = audit_logger._drain(audit_logger.queue.get_nowait())
+
+    assert [record.data["identifier"] for record in batch] == ["id1", "id2"]
+
+@pytest.mark.usefixtures("audit_logger")
+def test_do_s3_write(mocker, audit_logger):
+    put_object = mocker.patch.object(audit_logger.s3_client, "put_object",
+                                     return_value={"ResponseMetadata": {"HTTPStatusCode": 200}})
+    records = [
+        HTTPAuditLogger.Record(key="key1", data={"identifier": "id1"}),
+        HTTPAuditLogger.Record(key="key2", data={"identifier": "id2"}),
+    ]
+
+    # test a single record is written under its own key
+    audit_logger._do_s3_write(records[:1])
+
+    assert put_object.call_args.kwargs["Key"] == "key1"
+    assert put_object.call_args.kwargs["Body"] == b'{"identifier":"id1"}'
+
+    # test several records are written together as zstd compressed newline delimited JSON
+    audit_logger._do_s3_write(records)
+
+    assert put_object.call_args.kwargs["Key"].endswith(".ndjson.zst")
+    assert put_object.call_args.kwargs["ContentEncoding"] == "zstd"
+    body = zstandard.ZstdDecompressor().decompress(put_object.call_args.kwargs["Body"])
+    assert body == b'{"identifier":"id1"}\n{"identifier":"id2"}'
+
+    # test batch compression can be turned off
+    audit_logger.batch_compression = Options.COMPRESSION_NONE
+    audit_logger._do_s3_write(records)
+
+    assert put_object.call_args.kwargs["Key"].endswith(".ndjson")
+    assert put_object.call_args.kwargs["Body"] == b'{"identifier":"id1"}\n{"identifier":"id2"}'
+
+@pytest.mark.usefixtures("audit_logger")
+def test_queue_full_drop(mocker, audit_logger):
+    written = []
+    mocker.patch("to_do_api.audit_logging.http_audit_logger.HTTPAuditLogger._do_s3_write",
+                 lambda p1, p2: written.append(p2))
+    audit_logger.backpressure = Options.BACKPRESSURE_DROP
+
+    # test records are dropped instead of written once the queue is full
+    for audit_id in ("id1", "id2", "id3", "id4"):
+        audit_logger._queue_record(audit_id, {}, None)
+
+    assert written == []
+    assert audit_logger.dropped == 2
+
+def test_embeddable_body():
+    from to_do_api.audit_logging.http_audit_logger import _embeddable_body, _encode_json
+
+    # test single line JSON is embedded verbatim
+    body = b'{"name": "Test",  "username": "test"}'
+    assert _encode_json({"body": _embeddable_body(body)}) == b'{"body":' + body + b'}'
+
+    # test multi line JSON is serialized again so batches stay one record per line
+    assert _embeddable_body(b'{"name":\n"Test"}') == {"name": "Test"}
+
+    # test anything else is kept as text
+    assert _embeddable_body(b"not json") == "not json"
+
+@pytest.mark.usefixtures("audit_logger")
+def test_do_s3_write_msgpack_json_body(mocker, audit_logger):
+    from to_do_api.audit_logging.http_audit_logger import _MSGPACK_FORMAT, _embeddable_body
+
+    put_object = mocker.patch.object(audit_logger.s3_client, "put_object",
+                                     return_value={"ResponseMetadata": {"HTTPStatusCode": 200}})
+    audit_logger.record_format = _MSGPACK_FORMAT
+    records = [
+        HTTPAuditLogger.Record(key="key1", data={"identifier": "id1", "body": _embeddable_body(b'{"name":"Test"}')}),
+        HTTPAuditLogger.Record(key="key2", data={"identifier": "id2", "body": _embeddable_body(b"not json")}),
+    ]
+
+    # test a JSON body is written as a MessagePack map
+    audit_logger._do_s3_write(records[:1])
+
+    assert put_object.call_args.kwargs["Key"] == "key1.msgpack"
+    assert msgpack.unpackb(put_object.call_args.kwargs["Body"]) == {"identifier": "id1", "body": {"name": "Test"}}
+
+    # test a batch with a JSON body is written as well
+    audit_logger._do_s3_write(records)
+
+    assert put_object.call_args.kwargs["Key"].endswith(".msgpack.zst")
+    body = zstandard.ZstdDecompressor().decompress(put_object.call_args.kwargs["Body"])
+    assert list(msgpack.Unpacker(io.BytesIO(body))) == [
+        {"identifier": "id1", "body": {"name": "Test"}},
+        {"identifier": "id2", "body": "not json"},
+    ]
+
+def test_streamed_response_metadata():
+    from flask import Flask, Response
+    from to_do_api.audit_logging.http_audit_logger import _STREAMED_BODY
+
+    with Flask(__name__).test_request_context("/users"):
+        from flask import request
+
+        # test a streamed body is marked, as it is not available to the audit logger
+        response = Response(iter([b'{"Result":[]}']), mimetype="application/json")
+        metadata = HTTPAuditLogger._get_response_metadata(request, response, False, None)
+
+        assert metadata["body"] == _STREAMED_BODY
+
+        # test other bodies are logged
+        response = Response(b'{"Result":[]}', mimetype="application/json")
+        metadata = HTTPAuditLogger._get_response_metadata(request, response, False, None)
+
+        assert metadata["body"].content == b'{"Result":[]}'
+
+@pytest.mark.usefixtures("audit_logger")
+def test_log_inbound_fuse(mocker, audit_logger):
+    from flask import Flask
+
+    app = Flask(__name__)
+
+    @app.post("/users")
+    @audit_logger.log_inbound(fuse=True)
+    def insert_user():
+        return {"Result": "ok"}
+
+    # test request and response are logged in a single record
+    response = app.test_client().post("/users?verbose=1", data=b'{"name":"Test"}',
+                                      content_type="application/json")
+
+    assert response.status_code == 200
+    assert audit_logger.queue.qsize() == 1
+    data = audit_logger.queue.get_nowait().data
+    assert data["statusCode"] == 200
+    assert data["requestMethod"] == "POST"
+    assert data["requestQuery"] == "verbose=1"
+    assert "Content-Type: application/json" in data["requestHeaders"]
+    assert data["requestBody"].content == b'{"name":"Test"}'
+    assert "requestTimestamp" in data
+
+@pytest.mark.usefixtures("audit_logger")
+def test_log_inbound_error(mocker, audit_logger):
+    from flask import Flask
+    from to_do_api.audit_logging.http_audit_logger import _encode_json
+
+    app = Flask(__name__)
+
+    @app.get("/users")
+    @audit_logger.log_inbound()
+    def list_users():
+        raise ValueError("invalid user")
+
+    @app.errorhandler(ValueError)
+    def invalid_user(ex):
+        return {"error": str(ex)}, 400
+
+    # test a failed request still gets its response record, built by the application's error handler
+    response = app.test_client().get("/users")
+
+    assert response.status_code == 400
+    assert audit_logger.queue.qsize() == 2
+    request_data = audit_logger.queue.get_nowait().data
+    response_data = audit_logger.queue.get_nowait().data
+    assert request_data["method"] == "GET"
+    assert response_data["statusCode"] == 400
+    assert orjson.loads(_encode_json(response_data["body"])) == {"error": "invalid user"}
+
+@pytest.mark.usefixtures("audit_logger")
+def test_run_stop(mocker, audit_logger):
+    written = []
+    mocker.patch("to_do_api.audit_logging.http_audit_logger.HTTPAuditLogger._do_s3_write",
+                 lambda p1, p2: written.append(p2))
+    audit_logger._queue_record("id1", {}, None)
+    audit_logger._queue_record("id2", {}, None)
+
+    # test stopping the writer thread writes everything still queued
+    audit_logger.start()
+    audit_logger.stop()
+
+    assert not audit_logger.is_alive()
+    assert sorted(record.data["identifier"] for batch in written for record in batch) == ["id1", "id2"]
+    assert audit_logger.queue.empty()
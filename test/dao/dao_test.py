@@ -0,0 +1,73 @@
+import psycopg2
+import pytest
+from to_do_api.dao.dao import DAO
+
+@pytest.fixture()
+def pool(mocker):
+    connection = mocker.MagicMock(prepared=set(), closed=0)
+    cursor = connection.cursor.return_value
+    cursor.__enter__.return_value = cursor
+    pool = mocker.MagicMock()
+    pool.getconn.return_value = connection
+    mocker.patch("to_do_api.dao.dao.DAO._get_pool", return_value=pool)
+
+    yield pool
+
+@pytest.mark.usefixtures("pool")
+def test_execute_prepared(mocker, pool):
+    dao = DAO()
+    cursor = pool.getconn.return_value.cursor.return_value
+
+    # test the statement is prepared on the first use of the connection only
+    dao.execute("INSERT INTO t(a, b) VALUES($1, $2)", ("a", "b"), name="insert_t")
+    dao.execute("INSERT INTO t(a, b) VALUES($1, $2)", ("c", "d"), name="insert_t")
+
+    assert cursor.execute.call_args_list == [
+        mocker.call("PREPARE insert_t AS INSERT INTO t(a, b) VALUES($1, $2)"),
+        mocker.call("EXECUTE insert_t (%s, %s)", ("a", "b")),
+        mocker.call("EXECUTE insert_t (%s, %s)", ("c", "d")),
+    ]
+    assert pool.putconn.call_args_list == [mocker.call(pool.getconn.return_value, close=False)] * 2
+
+@pytest.mark.usefixtures("pool")
+def test_execute_values(mocker, pool):
+    execute_values = mocker.patch("psycopg2.extras.execute_values", return_value=[(1,), (2,)])
+
+    rows = DAO().execute_values("INSERT INTO t(a) VALUES %s RETURNING id", [("a",), ("b",)], template="(%s)")
+
+    assert rows == [(1,), (2,)]
+    assert execute_values.call_args.kwargs["template"] == "(%s)"
+    assert execute_values.call_args.kwargs["fetch"] is True
+    pool.putconn.assert_called_once()
+
+@pytest.mark.usefixtures("pool")
+def test_fetch_iter(mocker, pool):
+    dao = DAO()
+    cursor = pool.getconn.return_value.cursor.return_value
+    cursor.__iter__.side_effect = lambda: iter([(1,), (2,)])
+
+    # test the connection is held while the rows are read and given back once they are consumed
+    rows = dao.fetch_iter("SELECT id FROM t")
+
+    cursor.execute.assert_called_once_with("SELECT id FROM t", ())
+    pool.putconn.assert_not_called()
+    assert list(rows) == [(1,), (2,)]
+    pool.putconn.assert_called_once()
+
+    # test the connection is given back when the iterator is closed early
+    rows = dao.fetch_iter("SELECT id FROM t")
+    assert next(rows) == (1,)
+    rows.close()
+
+    assert pool.putconn.call_count == 2
+
+@pytest.mark.usefixtures("pool")
+def test_fetch_iter_error(mocker, pool):
+    cursor = pool.getconn.return_value.cursor.return_value
+    cursor.execute.side_effect = psycopg2.ProgrammingError("relation \"t\" does not exist")
+
+    # test query errors are raised by fetch_iter itself, not while streaming the rows
+    with pytest.raises(psycopg2.ProgrammingError):
+        DAO().fetch_iter("SELECT id FROM t")
+
+    pool.putconn.assert_called_once()
@@ -0,0 +1,24 @@
+import uuid
+
+import pytest
+from to_do_api.dao.user import UserDAO
+from to_do_api.models import User
+
+@pytest.fixture()
+def dao(mocker):
+    dao = UserDAO()
+
+    yield dao
+
+@pytest.mark.usefixtures("dao")
+def test_insert_users(mocker, dao):
+    execute_values = mocker.patch("to_do_api.dao.user.UserDAO.execute_values",
+                                  return_value=[(uuid.uuid4(),), (uuid.uuid4(),)])
+    users = [User(None, "Name 1", "username1"), User(None, "Name 2", "username2")]
+
+    # test the ids are left to the database and the inserted rows are counted
+    assert dao.insert_users(users) == 2
+
+    args, kwargs = execute_values.call_args
+    assert args[1] == [("username1", "Name 1"), ("username2", "Name 2")]
+    assert kwargs["template"] == "(gen_random_uuid(), %s, %s)"
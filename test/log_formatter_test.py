@@ -0,0 +1,39 @@
+import logging
+import sys
+
+import orjson
+from to_do_api.log_formatter import JSON_FORMATTER
+
+def _record(msg, *args, exc_info=None, stack_info=None):
+    record = logging.LogRecord("to_do_api", logging.ERROR, "/app/app.py", 10, msg, args, exc_info)
+    record.stack_info = stack_info
+    return record
+
+def test_format():
+    # test the record is one line of JSON, with quotes and new lines escaped
+    line = JSON_FORMATTER.format(_record('user "%s"\nnot found', "test"))
+
+    assert "\n" not in line
+    log = orjson.loads(line)
+    assert log["message"] == 'user "test"\nnot found'
+    assert log["name"] == "to_do_api"
+    assert log["filename"] == "app.py"
+    assert log["lineno"] == 10
+    assert log["levelname"] == "ERROR"
+    assert "exception" not in log
+    assert "stack" not in log
+
+def test_format_exception_and_stack():
+    try:
+        raise ValueError("invalid user")
+    except ValueError:
+        record = _record("error", exc_info=sys.exc_info(), stack_info="Stack (most recent call last):\n  ...")
+
+    # test the traceback and the stack are kept, still on a single line
+    line = JSON_FORMATTER.format(record)
+
+    assert "\n" not in line
+    log = orjson.loads(line)
+    assert log["exception"].startswith("Traceback (most recent call last):")
+    assert log["exception"].endswith("ValueError: invalid user")
+    assert log["stack"] == "Stack (most recent call last):\n  ..."
@@ -1,5 +1,7 @@
+import uuid
+
 import pytest
-from to_do_api.service.user import UserService
+from to_do_api.service.user import InvalidUserError, UserService
 
 @pytest.fixture()
 def service(mocker):
@@ -16,21 +18,26 @@ def test_insert_user(mocker, service):
     }
 
     # test success case
-    mocker.patch("to_do_api.dao.user.UserDAO.insert_user", lambda p1, p2: 1)
+    mocker.patch("to_do_api.dao.user.UserDAO.insert_user", lambda p1, p2: uuid.uuid4())
 
     new_user = service.insert_user(user)
     
     assert user["id"] != new_user.id
 
-    # test fail case 1
-    mocker.patch("to_do_api.dao.user.UserDAO.insert_user", lambda p1, p2: 0)
+    # test fail case, no row returned
+    mocker.patch("to_do_api.dao.user.UserDAO.insert_user", lambda p1, p2: None)
 
     with pytest.raises(Exception):
         service.insert_user(user)
+    
+
+@pytest.mark.usefixtures("service")
+def test_insert_user_invalid(mocker, service):
+    insert_user = mocker.patch("to_do_api.dao.user.UserDAO.insert_user")
 
-    # test fail case 2
-    mocker.patch("to_do_api.dao.user.UserDAO.insert_user", lambda p1, p2: 2)
+    # test payloads that aren't a user object are rejected before reaching the database
+    for user in ([1, 2], "user", {"username": "username1"}, {"name": "Name 1", "username": 1}):
+        with pytest.raises(InvalidUserError):
+            service.insert_user(user)
 
-    with pytest.raises(Exception):
-        service.insert_user(user)
-    
\ No newline at end of file
+    insert_user.assert_not_called()
@@ -0,0 +1,62 @@
+import zlib
+from http import HTTPStatus
+
+import brotli
+import pytest
+from flask import Flask, jsonify
+from to_do_api.utils import ORJSONProvider, json_stream_response, response_with_status
+
+@pytest.fixture()
+def app():
+    app = Flask(__name__)
+    app.json = ORJSONProvider(app)
+
+    yield app
+
+@pytest.mark.usefixtures("app")
+def test_orjson_provider(app):
+    with app.app_context():
+        # test responses and non string keys
+        response = jsonify({"id": 1, 1: "a"})
+
+        assert response.mimetype == "application/json"
+        assert response.get_data() == b'{"id":1,"1":"a"}'
+
+        assert app.json.loads(b'{"id":1}') == {"id": 1}
+
+        # test unsupported types are not turned into strings
+        with pytest.raises(TypeError):
+            jsonify({"s": {1, 2}})
+
+def test_response_with_status():
+    # test exceptions are rendered as strings
+    response = response_with_status(Exception("Error inserting user"), HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert response.get_data() == b'"Error inserting user"'
+
+@pytest.mark.usefixtures("app")
+def test_json_stream_response(app):
+    chunks = [b'{"Result":[', b'{"id":1}', b']}']
+
+    # test br is preferred when the client accepts it
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, deflate, br"}):
+        response = json_stream_response(iter(chunks))
+
+        assert response.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(response.get_data()) == b"".join(chunks)
+
+    # test gzip is used otherwise
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = json_stream_response(iter(chunks))
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS) == b"".join(chunks)
+
+    # test the body is streamed as is when the client doesn't accept compression
+    with app.test_request_context():
+        response = json_stream_response(iter(chunks))
+
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.get_data() == b"".join(chunks)
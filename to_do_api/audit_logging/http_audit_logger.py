@@ -1,27 +1,75 @@
-import json
+from __future__ import annotations
+
+import itertools
 import logging
 import os
 import queue
 import threading
 import time
-import typing as t
-from datetime import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from io import BytesIO
+from typing import TYPE_CHECKING
 
 import boto3
+import msgpack
+import orjson
+import zstandard
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.endpoint import is_valid_endpoint_url
 from botocore.exceptions import NoCredentialsError
-from flask import Request, Response, request
+from flask import current_app, request
+
+if TYPE_CHECKING:
+    import typing as t
+
+    from flask import Request, Response
 
 logger = logging.getLogger(__name__)
 
+# makes audit ids unique even when two records get the same nanosecond timestamp
+_audit_id_counter = itertools.count()
+
+# body of the response audit records of streamed responses
+_STREAMED_BODY = "<streamed>"
+
+# queued by stop() to wake the writer thread up and end it
+_SENTINEL = object()
+
 
 class Options:
     AUDITLOG_S3_DIRECTORY = "AUDITLOG_S3_DIRECTORY"
     AUDITLOG_S3_REGION = "AUDITLOG_S3_REGION"
     AUDITLOG_S3_BUCKET = "AUDITLOG_S3_BUCKET"
     AUDITLOG_S3_ENDPOINT = "AUDITLOG_S3_ENDPOINT"
+    AUDITLOG_QUEUE_MAX = "AUDITLOG_QUEUE_MAX"
+    AUDITLOG_BUFFER_SIZE = "AUDITLOG_BUFFER_SIZE"
+    AUDITLOG_BUFFER_TIME = "AUDITLOG_BUFFER_TIME"
+    AUDITLOG_UPLOAD_WORKERS = "AUDITLOG_UPLOAD_WORKERS"
+    AUDITLOG_BACKPRESSURE = "AUDITLOG_BACKPRESSURE"
+    AUDITLOG_BATCH_COMPRESSION = "AUDITLOG_BATCH_COMPRESSION"
+    AUDITLOG_FORMAT = "AUDITLOG_FORMAT"
+
+    __slots__ = ("bucket", "directory", "region", "endpoint", "queue_max", "buffer_size", "buffer_time",
+                 "upload_workers", "backpressure", "batch_compression", "record_format")
+
+    # What to do with a record when the queue is full
+    BACKPRESSURE_WRITE = "write"    # write it on the caller's thread
+    BACKPRESSURE_DROP = "drop"      # discard it
+    BACKPRESSURE_BLOCK = "block"    # wait for the writer thread to make room, then write it on the caller's thread
+    BACKPRESSURE_POLICIES = frozenset((BACKPRESSURE_WRITE, BACKPRESSURE_DROP, BACKPRESSURE_BLOCK))
+
+    # How batch files are compressed
+    COMPRESSION_NONE = "none"
+    COMPRESSION_ZSTD = "zstd"
+    COMPRESSIONS = frozenset((COMPRESSION_NONE, COMPRESSION_ZSTD))
+
+    # How records are encoded
+    FORMAT_JSON = "json"
+    FORMAT_MSGPACK = "msgpack"
+    FORMATS = frozenset((FORMAT_JSON, FORMAT_MSGPACK))
 
     @staticmethod
     def from_env():
@@ -29,24 +77,56 @@ class Options:
         s3_directory = os.getenv(Options.AUDITLOG_S3_DIRECTORY, "todo-api/")
         s3_region = os.getenv(Options.AUDITLOG_S3_REGION, "us-east-1")
         s3_endpoint = os.getenv(Options.AUDITLOG_S3_ENDPOINT, None)
-        return Options(s3_bucket=s3_bucket, s3_directory=s3_directory, s3_region=s3_region, s3_endpoint=s3_endpoint)
+        queue_max = int(os.getenv(Options.AUDITLOG_QUEUE_MAX, "10000"))
+        buffer_size = int(os.getenv(Options.AUDITLOG_BUFFER_SIZE, "512"))
+        buffer_time = int(os.getenv(Options.AUDITLOG_BUFFER_TIME, "200"))
+        upload_workers = int(os.getenv(Options.AUDITLOG_UPLOAD_WORKERS, "16"))
+        backpressure = os.getenv(Options.AUDITLOG_BACKPRESSURE, Options.BACKPRESSURE_WRITE)
+        batch_compression = os.getenv(Options.AUDITLOG_BATCH_COMPRESSION, Options.COMPRESSION_ZSTD)
+        record_format = os.getenv(Options.AUDITLOG_FORMAT, Options.FORMAT_JSON)
+        return Options(s3_bucket=s3_bucket, s3_directory=s3_directory, s3_region=s3_region, s3_endpoint=s3_endpoint,
+                       queue_max=queue_max, buffer_size=buffer_size, buffer_time=buffer_time,
+                       upload_workers=upload_workers, backpressure=backpressure,
+                       batch_compression=batch_compression, record_format=record_format)
 
     def __init__(self, s3_bucket: str, s3_directory: str, s3_region: str,
-                 s3_endpoint: str = None):
+                 s3_endpoint: str = None, queue_max: int = 10000, buffer_size: int = 512, buffer_time: int = 200,
+                 upload_workers: int = 16, backpressure: str = BACKPRESSURE_WRITE,
+                 batch_compression: str = COMPRESSION_ZSTD, record_format: str = FORMAT_JSON):
+        """
+        :param queue_max: Maximum number of records waiting to be written
+        :param buffer_size: Maximum number of records the writer thread takes from the queue at once
+        :param buffer_time: Maximum time, in milliseconds, the writer thread waits for a batch to fill up
+        :param upload_workers: Maximum number of batches being uploaded to S3 at the same time
+        :param backpressure: What to do with a record when the queue is full: write, drop or block
+        :param batch_compression: Compression of the files holding several records: zstd or none
+        :param record_format: Encoding of the records: json or msgpack (MessagePack, files get a .msgpack extension)
+        """
         self.bucket = s3_bucket
         self.directory = s3_directory
         self.region = s3_region
         self.endpoint = s3_endpoint
+        self.queue_max = queue_max
+        self.buffer_size = buffer_size
+        self.buffer_time = buffer_time
+        self.upload_workers = upload_workers
+        self.backpressure = backpressure
+        self.batch_compression = batch_compression
+        self.record_format = record_format
 
 
 class HTTPAuditLogger(threading.Thread):
     """
-    This is a concrete Audit record writer that is used to write JSON formatted files to an AWS S3 bucket such that
-    they can be consumed by other processes.
+    This is a concrete Audit record writer that is used to write JSON formatted files (or MessagePack ones, with
+    AUDITLOG_FORMAT=msgpack) to an AWS S3 bucket such that they can be consumed by other processes.
     Calls to `log_request` and `log_response` can be called in the main processing thread(s).  The functions are
     thread safe, so multi threads can call the log request/response directly w/o needing to worry about thread issues.
-    Internally, this class will marshal the request/response, then use a 2nd thread to do the actual S3 writing.
-    This Logger needs to match the GoLang AuditLogger's file naming and file contents.
+    Internally, this class will collect the request/response metadata, then use a 2nd thread to group the records in
+    batches, which a pool of upload threads serializes and writes to S3.  If the bounded queue is full, the record is
+    written on the caller's thread instead.
+    A batch with more than one record is written as a single newline delimited JSON (.ndjson) file, zstd compressed
+    (.ndjson.zst) unless AUDITLOG_BATCH_COMPRESSION is "none".
+    With the JSON format, this Logger needs to match the GoLang AuditLogger's file naming and file contents.
     """
     _RESERVED_FIELD_NAMES = {
         "identifier", "eventTimestamp", "host", "hostname", "method", "path", "query", "protocol", "headers", "body",
@@ -55,9 +135,11 @@ class HTTPAuditLogger(threading.Thread):
     }
 
     class Record:
-        def __init__(self, key: str, content: str):
+        __slots__ = ("key", "data")
+
+        def __init__(self, key: str, data: dict):
             self.key = key
-            self.content = content
+            self.data = data
 
     @staticmethod
     def from_env():
@@ -65,7 +147,7 @@ class HTTPAuditLogger(threading.Thread):
         return HTTPAuditLogger(opts=opts)
 
     def __init__(self, opts: Options) -> None:
-        super(HTTPAuditLogger, self).__init__()
+        super(HTTPAuditLogger, self).__init__(daemon=True)
 
         # validate fields
         if not opts.bucket:
@@ -81,86 +163,240 @@ class HTTPAuditLogger(threading.Thread):
         if not opts.region:
             raise Exception('s3_region not informed.')
 
+        if opts.buffer_size < 1:
+            raise Exception('buffer_size must be greater than zero.')
+
+        if opts.buffer_time < 0:
+            raise Exception('buffer_time must not be negative.')
+
+        if opts.upload_workers < 1:
+            raise Exception('upload_workers must be greater than zero.')
+
+        if opts.backpressure not in Options.BACKPRESSURE_POLICIES:
+            raise Exception('backpressure invalid.')
+
+        if opts.batch_compression not in Options.COMPRESSIONS:
+            raise Exception('batch_compression invalid.')
+
+        if opts.record_format not in Options.FORMATS:
+            raise Exception('record_format invalid.')
+
         self.s3_bucket = opts.bucket
-        self.s3_directory = opts.directory
+        self.s3_directory = opts.directory.rstrip('/')
+        # static part of every key, so building one is just a concatenation
+        self._key_prefix = self.s3_directory + '/'
         self.s3_endpoint = opts.endpoint
         self.s3_region = opts.region
-
-        self.s3_client = boto3.client('s3', region_name=self.s3_region, endpoint_url=self.s3_endpoint)
-
-        self.queue = queue.Queue()
-        self.end_event = threading.Event()
+        self._hour_path_cache = (None, "")
+
+        # a single client is shared by all the upload threads, with enough pooled connections to keep them reused
+        self.s3_client = boto3.client('s3', region_name=self.s3_region, endpoint_url=self.s3_endpoint,
+                                      config=Config(max_pool_connections=64,
+                                                    retries={'max_attempts': 3, 'mode': 'adaptive'}))
+        self.transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024,
+                                              multipart_chunksize=8 * 1024 * 1024)
+
+        self.buffer_size = opts.buffer_size
+        self.buffer_time = opts.buffer_time / 1000
+
+        self.queue = queue.Queue(maxsize=opts.queue_max)
+        self.backpressure = opts.backpressure
+        self.batch_compression = opts.batch_compression
+        self.record_format = _MSGPACK_FORMAT if opts.record_format == Options.FORMAT_MSGPACK else _JSON_FORMAT
+        self.dropped = 0
+        self._last_drop_warning = 0.0
+        # records are dropped by the request threads, concurrently
+        self._drop_lock = threading.Lock()
+
+        self.upload_executor = ThreadPoolExecutor(max_workers=opts.upload_workers, thread_name_prefix="audit-upload")
+        # bounds the batches handed to the executor, so records keep waiting in the bounded queue instead
+        self.upload_slots = threading.BoundedSemaphore(opts.upload_workers)
 
     def stop(self):
-        self.end_event.set()
+        self.queue.put(_SENTINEL)
         self.join()
 
     def run(self):
-        while not self.end_event.is_set():
+        while True:
+            # blocks until there is something to write, so an idle logger never wakes up
+            record = self.queue.get()
+            if record is _SENTINEL:
+                break
+
+            batch = self._drain(record)
+            stopping = batch[-1] is _SENTINEL
+            if stopping:
+                batch.pop()
+            self._upload(batch)
+            if stopping:
+                break
+
+        # flush whatever is left so stopping the logger does not lose records
+        batch = []
+        while True:
             try:
-                record = self.queue.get(timeout=0.1)
+                record = self.queue.get_nowait()
             except queue.Empty:
+                break
+            if record is _SENTINEL:
                 continue
 
-            self._do_s3_write(record)
+            batch.append(record)
 
-    def log_request(self, req: Request):
+            if len(batch) == self.buffer_size:
+                self._upload(batch)
+                batch = []
+
+        if batch:
+            self._upload(batch)
+
+        self.upload_executor.shutdown(wait=True)
+
+    def _upload(self, batch: t.List[Record]) -> None:
+        """
+        Write the batch on one of the upload threads, waiting for a free one
+        """
+        self.upload_slots.acquire()
         try:
-            audit_id = HTTPAuditLogger._make_audit_id(req, False)
-            metadata = HTTPAuditLogger._get_request_metadata(req)
-            req_data = req
-            self._queue_record(audit_id, metadata, req_data)
-        except Exception:
-            raise
+            future = self.upload_executor.submit(self._do_s3_write, batch)
+        except RuntimeError:
+            # the executor takes no new work once the interpreter is exiting (stop() called from atexit),
+            # write the batch on this thread instead
+            self.upload_slots.release()
+            self._do_s3_write(batch)
+            return
+        future.add_done_callback(lambda _: self.upload_slots.release())
+
+    def _drain(self, first: Record) -> t.List[Record]:
+        """
+        Collect up to `buffer_size` records, waiting at most `buffer_time` for the batch to fill up.
+        Stops early at the stop sentinel, which is then the last item of the batch
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.buffer_time
+        while len(batch) < self.buffer_size:
+            try:
+                # never block when the batch window is over, but still take what is already queued
+                timeout = deadline - time.monotonic()
+                record = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(record)
+            if record is _SENTINEL:
+                break
+
+        return batch
+
+    def log_request(self, req: Request):
+        audit_id = HTTPAuditLogger._make_audit_id(req, False)
+        metadata = HTTPAuditLogger._get_request_metadata(req)
+        self._queue_record(audit_id, metadata, req)
 
     def log_response(self, req: Request, resp: Response, include_request_in_response: bool,
-                     request_timestamp: t.Optional[datetime]):
-        try:
-            audit_id = HTTPAuditLogger._make_audit_id(req, True)
-            metadata = HTTPAuditLogger._get_response_metadata(req, resp, include_request_in_response, request_timestamp)
-            req_data = req
-            self._queue_record(audit_id, metadata, req_data)
-        except Exception:
-            raise
+                     request_timestamp: t.Optional[str], fused: bool = False):
+        audit_id = HTTPAuditLogger._make_audit_id(req, True)
+        metadata = HTTPAuditLogger._get_response_metadata(req, resp, include_request_in_response, request_timestamp,
+                                                          fused)
+        self._queue_record(audit_id, metadata, req)
 
     def _queue_record(self, audit_id: str, data: dict, req_data: t.Optional[Request]):
         # Set the identifier and Timestamp last to ensure it's not overridden.
         # To help consistency, these two fields are set in the golang `audit/logger.go` file, while the `data`
         # fields are populated in the `httpaudit/httpaudit.go` file.
-        data["eventTimestamp"] = _utc_now_str()
-        data["identifier"] = audit_id
-
+        # The record gets its own dict, the caller's `data` is left untouched.
         record = HTTPAuditLogger.Record(
             key=self._make_key(audit_id),
-            content=json.dumps(data)
+            data={**data, "eventTimestamp": _utc_now_str(), "identifier": audit_id}
         )
-        self.queue.put(record, block=False)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._queue_full(record)
+
+    def _queue_full(self, record: Record) -> None:
+        """
+        The writer thread can't keep up, apply the backpressure policy to the record
+        """
+        if self.backpressure == Options.BACKPRESSURE_DROP:
+            # warn at most every 10 seconds, not for every dropped record
+            now = time.monotonic()
+            with self._drop_lock:
+                self.dropped += 1
+                dropped = self.dropped
+                warn = now - self._last_drop_warning >= 10
+                if warn:
+                    self._last_drop_warning = now
+            if warn:
+                logger.warning("Audit log queue full, dropping records. dropped=%s pending=%s",
+                               dropped, self.queue.qsize())
+            return
+
+        if self.backpressure == Options.BACKPRESSURE_BLOCK:
+            try:
+                self.queue.put(record, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+        # write on this thread instead of losing the record
+        self._do_s3_write([record])
 
-    def _do_s3_write(self, record: Record) -> None:
+    def _do_s3_write(self, records: t.List[Record]) -> None:
         """
-        Save content to s3 bucket, should not be called in main thread
+        Save content to s3 bucket, should not be called in main thread unless the queue is full
+        A single record is saved under its own key, several records are saved together in one file (newline delimited
+        JSON, or a sequence of MessagePack objects)
         """
         metadata = {}       # The metadata parameter can't be None or Boto3 raises an error
         try:
-            s3_put_response = self.s3_client.put_object(
-                Bucket=self.s3_bucket,
-                Key=record.key,
-                Body=record.content,
-                ContentEncoding="binary/octet-stream",
-                ContentType="application/json; charset=utf-8",
-                ContentLength=len(record.content),
-                ServerSideEncryption="AES256",
-                Metadata=metadata
-            )
-
-            if s3_put_response['ResponseMetadata']['HTTPStatusCode'] != 200:
-                raise Exception(f'Unable to put data to s3: {s3_put_response}')
-
-            return_object = {
-                "region": self.s3_region,
-                "location": f's3://{self.s3_bucket}/{record.key}'
+            encode = self.record_format.encode
+            content_encoding = "binary/octet-stream"
+            if len(records) == 1:
+                key = records[0].key + self.record_format.key_suffix
+                content = encode(records[0].data)
+                content_type = self.record_format.content_type
+            else:
+                key = self._make_batch_key()
+                content = self.record_format.batch_separator.join(encode(record.data) for record in records)
+                content_type = self.record_format.batch_content_type
+
+                if self.batch_compression == Options.COMPRESSION_ZSTD:
+                    content = _zstd_compressor().compress(content)
+                    key += ".zst"
+                    content_encoding = "zstd"
+                    metadata["codec"] = "zstd"
+
+            put_args = {
+                "ContentEncoding": content_encoding,
+                "ContentType": content_type,
+                "ServerSideEncryption": "AES256",
+                "Metadata": metadata,
             }
-            logger.info(f"Wrote audit log. {return_object}")
+
+            if len(content) >= self.transfer_config.multipart_threshold:
+                # large batches are uploaded in parts, in parallel; failures are raised by boto3
+                self.s3_client.upload_fileobj(BytesIO(content), self.s3_bucket, key, ExtraArgs=put_args,
+                                              Config=self.transfer_config)
+            else:
+                s3_put_response = self.s3_client.put_object(
+                    Bucket=self.s3_bucket,
+                    Key=key,
+                    Body=content,
+                    **put_args
+                )
+
+                if s3_put_response['ResponseMetadata']['HTTPStatusCode'] != 200:
+                    raise Exception(f'Unable to put data to s3: {s3_put_response}')
+
+            # only build the message when it is going to be emitted
+            if logger.isEnabledFor(logging.INFO):
+                return_object = {
+                    "region": self.s3_region,
+                    "location": f's3://{self.s3_bucket}/{key}',
+                    "records": len(records),
+                    "pending": self.queue.qsize()
+                }
+                logger.info("Wrote audit log. %s", return_object)
 
         except NoCredentialsError as err:
             logger.error(f"Error writing audit log. {str(err)}")
@@ -168,19 +404,49 @@ class HTTPAuditLogger(threading.Thread):
             logger.error(f"Error writing audit log. {str(err)}")
 
     def _make_key(self, audit_id: str) -> str:
-        key = f'{self.s3_directory}/{datetime.now().strftime("%Y/%m/%d/%H/")}{audit_id}'
-        return key
+        return self._key_prefix + self._hour_path() + audit_id
+
+    def _hour_path(self) -> str:
+        """
+        The "YYYY/MM/DD/HH/" (UTC) part of the keys, only formatted again when the hour changes
+        """
+        hour = int(time.time()) // 3600
+        cached_hour, path = self._hour_path_cache
+        if hour != cached_hour:
+            path = time.strftime("%Y/%m/%d/%H/", time.gmtime(hour * 3600))
+            self._hour_path_cache = (hour, path)
+        return path
+
+    def _make_batch_key(self) -> str:
+        return self._make_key(f'batch_{time.time_ns()}_{uuid.uuid4().hex}{self.record_format.batch_extension}')
+
+    @staticmethod
+    def _request_line(req: Request) -> dict:
+        """
+        Host, method, path... of the request, built once per request and shared by its request and response records
+        """
+        line = getattr(req, "_audit_request_line", None)
+        if line is None:
+            line = {
+                "host": req.host,
+                "hostname": req.root_url,
+                "method": req.method,
+                "path": req.path,
+                "protocol": req.environ.get('SERVER_PROTOCOL'),
+            }
+            req._audit_request_line = line
+        return line
+
+    @staticmethod
+    def _request_headers(req: Request) -> t.List[str]:
+        return [f"{key}: {value}" for key, value in req.headers.items()]
 
     @staticmethod
     def _get_request_metadata(req: Request) -> dict:
         metadata = {
-            "host": req.host,
-            "hostname": req.root_url,
-            "method": req.method,
-            "path": req.path,
-            "protocol": req.environ.get('SERVER_PROTOCOL'),
+            **HTTPAuditLogger._request_line(req),
             "query": req.query_string.decode("utf-8"),  # convert to string
-            "headers": list(req.headers),
+            "headers": HTTPAuditLogger._request_headers(req),
         }
 
         if req.content_length:
@@ -190,22 +456,31 @@ class HTTPAuditLogger(threading.Thread):
 
     @staticmethod
     def _get_response_metadata(req: Request, response: Response, include_request_in_response: bool,
-                               request_timestamp: t.Optional[str]) -> dict:
+                               request_timestamp: t.Optional[str], fused: bool = False) -> dict:
+        line = HTTPAuditLogger._request_line(req)
         metadata = {
-            "requestHost": req.host,
-            "requestHostname": req.root_url,
-            "requestMethod": req.method,
-            "requestPath": req.path,
-            "requestProtocol": req.environ.get('SERVER_PROTOCOL'),
-            "protocol": req.environ.get('SERVER_PROTOCOL'),
+            "requestHost": line["host"],
+            "requestHostname": line["hostname"],
+            "requestMethod": line["method"],
+            "requestPath": line["path"],
+            "requestProtocol": line["protocol"],
+            "protocol": line["protocol"],
             "status": response.status,
             "statusCode": response.status_code,
-            "headers": list(response.headers),
+            "headers": [f"{key}: {value}" for key, value in response.headers.items()],
         }
-        if response.content_length:
+        if response.is_streamed:
+            # the body is sent while it is produced (e.g. GET /users) and is not kept, mark it instead of omitting it
+            metadata["body"] = _STREAMED_BODY
+        elif response.content_length:
             metadata["body"] = HTTPAuditLogger._response_body(resp=response)
 
-        if include_request_in_response:
+        if fused:
+            # the response record stands for the request record too
+            metadata["requestQuery"] = req.query_string.decode("utf-8")
+            metadata["requestHeaders"] = HTTPAuditLogger._request_headers(req)
+
+        if include_request_in_response or fused:
             if req.content_length:
                 metadata["requestBody"] = HTTPAuditLogger._request_body(req)
             if request_timestamp:
@@ -217,57 +492,55 @@ class HTTPAuditLogger(threading.Thread):
     def _make_audit_id(req: Request, is_response: bool) -> str:
         """
         Creates an audit id for an `upstream` audit log record.  See golang package for more details
-        The Audit ID should be unique, so for an HTTP message we append the nanosecond timestamp to the end
+        The Audit ID should be unique, so for an HTTP message we append the nanosecond timestamp and a counter to the
+        end
         """
-        audit_id = "in{0}{1}{2}{3}".format(req.path, "" if req.path.endswith("/") else "/", req.method,
-                                           "/response" if is_response else "/request")
-        audit_id += f'_{time.time_ns()}'
-        return audit_id
+        # the request and response records share the normalized path, so it is only built once per request
+        path = getattr(req, "_audit_path", None)
+        if path is None:
+            path = req.path if req.path.endswith("/") else req.path + "/"
+            req._audit_path = path
+
+        suffix = "/response" if is_response else "/request"
+        return f'in{path}{req.method}{suffix}_{time.time_ns()}_{next(_audit_id_counter)}'
 
     @staticmethod
-    def _request_body(req: Request) -> str:
+    def _request_body(req: Request) -> t.Any:
         """
         Retrieve the request body without making it unavailable
-        consuming the form data in middleware will make it unavailable to the final application
+        consuming the form data in middleware will make it unavailable to the final application, so the body is read
+        with `get_data(cache=True)`, which keeps it on the request for the application (and for form parsing).
+        The result is cached on the request as well, so a body logged in both request and response is parsed once.
         """
-        body = req.data
+        if hasattr(req, "_audit_cached_body"):
+            return req._audit_cached_body
+
+        body = req.get_data(cache=True, as_text=False)
         # noinspection PyBroadException
         try:
-            req.environ['wsgi.input'] = BytesIO(body)
-            content = body.decode("utf-8")
-            # Try to convert to Python object.  If fails, return as byte array
-            try:
-                json_body = json.loads(content)
-                return json_body
-            except ValueError:
-                pass
-
+            content = _embeddable_body(body)
         except Exception:
             content = "bodyReadError"
+
+        req._audit_cached_body = content
         return content
 
     @staticmethod
-    def _response_body(resp: Response) -> str:
+    def _response_body(resp: Response) -> t.Any:
         """
         Retrieve the response body without making it unavailable
         """
         body = resp.data
         # noinspection PyBroadException
         try:
-            content = body.decode("utf-8")
-            # Try to convert to Python object.  If fails, return as byte array
-            try:
-                json_body = json.loads(content)
-                return json_body
-            except ValueError:
-                pass
+            content = _embeddable_body(body)
         except Exception:
             content = "bodyReadError"
         return content
 
     # Decorators for direct use of this Audit Logger class
     def log_inbound(self, log_request=True, log_response=True,
-                    include_request_in_response=False):
+                    include_request_in_response=False, fuse=False):
         """
         Usage 1: add audit logging to route and log both inbound and outbound messages
         .. code-block:: python
@@ -283,23 +556,37 @@ class HTTPAuditLogger(threading.Thread):
         def handle_request():
             do work...
 
+        Usage 3: log request and response in a single record, written once the response is ready
+        .. code-block:: python
+        @app.route("/some_route")
+        @audit_logger.log_inbound(fuse=True)
+        def handle_request():
+            do work...
+
         :param log_request: Generate Request Audit Log message
         :param log_response: Generate Response Audit Log message
         :param include_request_in_response:  If True, adds the request body as top level field in response audit log
+        :param fuse: If True and both messages are enabled, generate only the Response Audit Log message, with the
+            request query, headers, body and timestamp added to it
         """
 
         def _log_inbound(f):
             @wraps(f)
             def __log_inbound(*args, **kwargs):
+                fused = fuse and log_request and log_response
                 request_timestamp = None
-                if include_request_in_response:
+                if include_request_in_response or fused:
                     request_timestamp = _utc_now_str()
-                if log_request:
+                if log_request and not fused:
                     self.log_request(req=request)
-                result = f(*args, **kwargs)
+                try:
+                    result = f(*args, **kwargs)
+                except Exception as ex:
+                    # let the application's error handlers build the response, so failed requests are audited too
+                    result = current_app.make_response(current_app.handle_user_exception(ex))
                 if log_response:
                     self.log_response(req=request, resp=result, include_request_in_response=include_request_in_response,
-                                      request_timestamp=request_timestamp)
+                                      request_timestamp=request_timestamp, fused=fused)
                 return result
 
             return __log_inbound
@@ -307,10 +594,91 @@ class HTTPAuditLogger(threading.Thread):
         return _log_inbound
 
 
+class _RecordFormat:
+    def __init__(self, encode: t.Callable[[dict], bytes], content_type: str, key_suffix: str,
+                 batch_content_type: str, batch_extension: str, batch_separator: bytes):
+        self.encode = encode
+        self.content_type = content_type
+        self.key_suffix = key_suffix
+        self.batch_content_type = batch_content_type
+        self.batch_extension = batch_extension
+        self.batch_separator = batch_separator
+
+
+class _RawJSON:
+    """
+    A valid JSON body, kept as the original bytes so each record format can embed it its own way
+    """
+    __slots__ = ("content",)
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+def _embeddable_body(body: bytes) -> t.Any:
+    """
+    Body as it goes in the audit record. Valid JSON is kept verbatim, so it is only validated instead of parsed and
+    serialized again; anything else is kept as text
+    """
+    try:
+        content = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return body.decode("utf-8")
+
+    # batches are one record per line, so JSON spanning several lines is serialized again (compact)
+    return content if b"\n" in body else _RawJSON(body)
+
+
+def _json_default(obj: t.Any) -> t.Any:
+    if isinstance(obj, _RawJSON):
+        return orjson.Fragment(obj.content)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _encode_json(data: dict) -> bytes:
+    return orjson.dumps(data, default=_json_default)
+
+
+def _msgpack_default(obj: t.Any) -> t.Any:
+    if isinstance(obj, _RawJSON):
+        return orjson.loads(obj.content)
+    raise TypeError(f"can not serialize {type(obj).__name__!r} object")
+
+
+def _encode_msgpack(data: dict) -> bytes:
+    return msgpack.packb(data, use_bin_type=True, default=_msgpack_default)
+
+
+# single records keep the key the Go AuditLogger uses, batches are newline delimited JSON
+_JSON_FORMAT = _RecordFormat(_encode_json, "application/json; charset=utf-8", "",
+                             "application/x-ndjson; charset=utf-8", ".ndjson", b"\n")
+# batches are MessagePack objects one after the other, readable with msgpack.Unpacker
+_MSGPACK_FORMAT = _RecordFormat(_encode_msgpack, "application/msgpack", ".msgpack",
+                                "application/msgpack", ".msgpack", b"")
+
+_zstd = threading.local()
+
+
+def _zstd_compressor() -> zstandard.ZstdCompressor:
+    """
+    Compressors can't be used by several threads at once, so each upload thread keeps its own
+    """
+    compressor = getattr(_zstd, "compressor", None)
+    if compressor is None:
+        compressor = _zstd.compressor = zstandard.ZstdCompressor(level=3)
+    return compressor
+
+
+_timestamp_cache = threading.local()
+
+
 def _utc_now_str() -> str:
     """
-    Not the ideal way to do ISO timestamp formatting to add UTC 'Z' to the end,
-    We are passing in UTC time, but not setting a timezone, so this is a quick solution
+    Current UTC time in ISO format with microseconds and a 'Z' suffix, e.g. 2023-01-31T12:34:56.789012Z
+    The date and time up to the seconds is only formatted again when the second changes (per thread, no locking)
     """
-    timestamp = datetime.utcnow().isoformat() + "Z"
-    return timestamp
+    seconds, nanoseconds = divmod(time.time_ns(), 1_000_000_000)
+    if getattr(_timestamp_cache, "seconds", None) != seconds:
+        _timestamp_cache.seconds = seconds
+        _timestamp_cache.prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return f'{_timestamp_cache.prefix}.{nanoseconds // 1000:06d}Z'
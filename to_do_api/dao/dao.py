@@ -1,54 +1,142 @@
+from __future__ import annotations
+
 import os
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+
+if TYPE_CHECKING:
+    import typing as t
 
 
 # register uuid
 psycopg2.extras.register_uuid()
 
+# connections are shared by every DAO of the process, see DAO._get_pool
+_pool = None
+_pool_lock = threading.Lock()
+
+class _Connection(psycopg2.extensions.connection):
+    """
+    Connection that keeps track of the statements already prepared on it
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
 class DAO:
     DB_HOST = "DB_HOST"
     DB_PORT = "DB_PORT"
     DB_USER = "DB_USER"
     DB_PASSWORD = "DB_PASSWORD"
     DB_DATABASE = "DB_DATABASE"
+    DB_POOL_MIN = "DB_POOL_MIN"
+    DB_POOL_MAX = "DB_POOL_MAX"
 
-    def __init__(self):
-        self.__connection = None
-        try:
-            self.__connection = psycopg2.connect(user=os.getenv(DAO.DB_USER, "postgres"),
+    @staticmethod
+    def _get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+        # created on first use, so a database that is unavailable at start up doesn't break the application
+        global _pool
+        if _pool is None:
+            with _pool_lock:
+                if _pool is None:
+                    _pool = psycopg2.pool.ThreadedConnectionPool(minconn=int(os.getenv(DAO.DB_POOL_MIN, "1")),
+                                    maxconn=int(os.getenv(DAO.DB_POOL_MAX, "16")),
+                                    user=os.getenv(DAO.DB_USER, "postgres"),
                                     password=os.getenv(DAO.DB_PASSWORD, "example"),
                                     host=os.getenv(DAO.DB_HOST, "db"),
                                     port=os.getenv(DAO.DB_PORT, "5432"),
-                                    database=os.getenv(DAO.DB_DATABASE, "todo"))
-        except:
-            pass
-    
-    def execute(self, sql: str, parameters: tuple) -> int:
-        try:
-            self.__cursor = self.__connection.cursor()
-            self.__cursor.execute(sql, parameters)
-
-            self.__connection.commit()
+                                    database=os.getenv(DAO.DB_DATABASE, "todo"),
+                                    connection_factory=_Connection)
+        return _pool
 
-            return self.__cursor.rowcount
-        except Exception as ex:
-            raise ex
+    @contextmanager
+    def _connection(self):
+        pool = DAO._get_pool()
+        connection = pool.getconn()
+        try:
+            yield connection
         finally:
-            self.__cursor.close
+            # a connection that was lost is discarded instead of going back to the pool
+            pool.putconn(connection, close=bool(connection.closed))
     
+    def execute(self, sql: str, parameters: tuple, name: str = None) -> int:
+        with self._connection() as connection:
+            # the connection block commits, or rolls back if the statement fails
+            with connection, connection.cursor() as cursor:
+                DAO._execute(connection, cursor, sql, parameters, name)
+
+                return cursor.rowcount
+
+    def fetch_one(self, sql: str, parameters: tuple, name: str = None) -> t.Optional[tuple]:
+        """
+        Execute `sql` and return its first row, e.g. the `RETURNING` row of an INSERT, in the same round trip
+        """
+        with self._connection() as connection:
+            with connection, connection.cursor() as cursor:
+                DAO._execute(connection, cursor, sql, parameters, name)
+
+                return cursor.fetchone()
+
+    @staticmethod
+    def _execute(connection: _Connection, cursor, sql: str, parameters: tuple, name: t.Optional[str]) -> None:
+        """
+        When `name` is given, `sql` is written with $1, $2... placeholders and runs as a server side prepared
+        statement. The statement is prepared the first time it is used on each pooled connection, so later executions
+        skip the parsing and planning.
+        """
+        if name is None:
+            cursor.execute(sql, parameters)
+            return
+
+        if name not in connection.prepared:
+            cursor.execute(f"PREPARE {name} AS {sql}")
+            connection.prepared.add(name)
+
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(parameters))})", parameters)
+
+    def execute_values(self, sql: str, values: list, template: str = None, page_size: int = 500) -> list:
+        """
+        Execute `sql`, which has a single `VALUES %s`, for all the `values` in pages of `page_size` rows, i.e. one round
+        trip per page instead of one per row. `template` is the SQL of each row, e.g. `(gen_random_uuid(), %s, %s)`.
+        Returns the rows of a `RETURNING` clause, if any.
+        """
+        with self._connection() as connection:
+            with connection, connection.cursor() as cursor:
+                return psycopg2.extras.execute_values(cursor, sql, values, template=template, page_size=page_size,
+                                                      fetch=True)
+
     def fetch_all(self, sql: str) -> list:
-        try:
-            self.__cursor = self.__connection.cursor()
-            self.__cursor.execute(sql, ())
+        with self._connection() as connection:
+            with connection, connection.cursor() as cursor:
+                cursor.execute(sql, ())
 
-            return self.__cursor.fetchall()
-        except Exception as ex:
-            raise ex
-        finally:
-            self.__cursor.close
+                return cursor.fetchall()
+
+    def fetch_iter(self, sql: str, parameters: tuple = (), itersize: int = 1000) -> t.Iterator[tuple]:
+        """
+        Rows of the query, read from a server side cursor `itersize` rows at a time instead of loading the whole result
+        in memory. Rows are named tuples. The query runs before this returns, so its errors are raised here; the
+        connection goes back to the pool once the rows are consumed or the iterator is closed.
+        """
+        rows = self._iter_rows(sql, parameters, itersize)
+        next(rows)
+        return rows
+
+    def _iter_rows(self, sql: str, parameters: tuple, itersize: int) -> t.Iterator[tuple]:
+        with self._connection() as connection:
+            with connection, connection.cursor(name=f"fetch_iter_{uuid.uuid4().hex}",
+                                               cursor_factory=psycopg2.extras.NamedTupleCursor) as cursor:
+                cursor.itersize = itersize
+                cursor.execute(sql, parameters)
+
+                # the query ran, fetch_iter can hand the rows over
+                yield None
 
-    def __del__(self):
-        if self.__connection:
-            self.__connection.close()
\ No newline at end of file
+                yield from cursor
@@ -1,18 +1,34 @@
-import typing as t
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 
 from to_do_api.models import User
 
 from to_do_api.dao.dao import DAO
 
+if TYPE_CHECKING:
+    import typing as t
+    import uuid
+
 
 class UserDAO(DAO):
     def __init__(self):
         super().__init__()
 
-    def insert_user(self, user: User) -> int:
-        return self.execute("INSERT INTO public.user(id, username, name) VALUES(%s,%s,%s)", (user.id, user.username, user.name))
+    def insert_user(self, user: User) -> t.Optional[uuid.UUID]:
+        # the id is generated by the database, in the same round trip
+        row = self.fetch_one("INSERT INTO public.user(id, username, name) VALUES(gen_random_uuid(),$1,$2) RETURNING id",
+                             (user.username, user.name), name="insert_user")
+        return row[0] if row else None
+
+    def insert_users(self, users: t.List[User]) -> int:
+        # the ids are generated by the database, like in insert_user
+        rows = self.execute_values("INSERT INTO public.user(id, username, name) VALUES %s RETURNING id",
+                                   [(user.username, user.name) for user in users],
+                                   template="(gen_random_uuid(), %s, %s)")
+        return len(rows)
 
-    def list_users(self) -> t.List[User]:
-        users = self.fetch_all("SELECT id, name, username FROM public.user")
-        users = [User(user[0], user[1], user[2]) for user in users]
-        return users
\ No newline at end of file
+    def list_users(self) -> t.Iterator[User]:
+        # the query runs here, the rows are read and turned into User objects while the result is consumed
+        users = self.fetch_iter("SELECT id, name, username FROM public.user")
+        return (User(user.id, user.name, user.username) for user in users)
\ No newline at end of file
@@ -0,0 +1,37 @@
+import logging
+from datetime import datetime
+
+import orjson
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each log record as a single line JSON object, serialized with orjson so messages containing quotes or
+    new lines still produce valid JSON for filebeat.
+    """
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str = None) -> str:
+        return datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds")
+
+    def format(self, record: logging.LogRecord) -> str:
+        log = {
+            "time": self.formatTime(record),
+            "name": record.name,
+            "filename": record.filename,
+            "lineno": record.lineno,
+            "levelname": record.levelname,
+            "message": record.getMessage(),
+        }
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log["exception"] = record.exc_text
+        if record.stack_info:
+            log["stack"] = self.formatStack(record.stack_info)
+
+        return orjson.dumps(log).decode("utf-8")
+
+
+# JSONFormatter keeps no per handler state, every handler can share this instance
+JSON_FORMATTER = JSONFormatter()
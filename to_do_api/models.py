@@ -1,12 +1,28 @@
 import uuid
 from enum import Enum
 
+import orjson
+
 
 class User:
+    __slots__ = ("id", "name", "username", "_json_cache")
+
     def __init__(self, id: str, name: str, username: str):
         self.id = id
         self.name = name
         self.username = username
+        self._json_cache = None
+
+    def to_json_bytes(self) -> bytes:
+        """
+        JSON representation of the user, serialized on first use and reused afterwards
+        """
+        if self._json_cache is None:
+            self._json_cache = orjson.dumps({"id": self.id, "name": self.name, "username": self.username})
+        return self._json_cache
+
+    def invalidate_json_cache(self):
+        self._json_cache = None
 
 
 class TaskState(Enum):
@@ -16,8 +32,11 @@ class TaskState(Enum):
 
 
 class Task:
-    def __init__(self, description: str, user_id: str, state: TaskState):
-        self.id = uuid.uuid4()
+    __slots__ = ("id", "description", "state", "user_id")
+
+    def __init__(self, description: str, user_id: str, state: TaskState, id: uuid.UUID = None):
+        # None until the database assigns it on insert
+        self.id = id
         self.description = description
         self.state = state
         self.user_id = user_id
@@ -1,24 +1,41 @@
-import json
-import typing as t
-import uuid
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 
 from to_do_api.dao.user import UserDAO
 from to_do_api.models import User
 
+if TYPE_CHECKING:
+    import typing as t
+
+
+class InvalidUserError(ValueError):
+    """
+    The user sent by the client is not valid, e.g. it has no name or username
+    """
+
 
 class UserService:
     def __init__(self):
         self.__dao = UserDAO()
 
-    def insert_user(self, json_user: dict) -> User:
-        user = User(**json_user)
+    def insert_user(self, json_user: t.Any) -> User:
+        if not isinstance(json_user, dict):
+            raise InvalidUserError("The user must be a JSON object")
+        name = json_user.get("name")
+        username = json_user.get("username")
+        if not isinstance(name, str) or not isinstance(username, str):
+            raise InvalidUserError("The user must have a name and a username")
+
+        # the id is generated by the database, an id sent by the client is ignored
+        user = User(None, name, username)
 
-        user.id = uuid.uuid4()
-        row_count = self.__dao.insert_user(user)
+        user.id = self.__dao.insert_user(user)
+        user.invalidate_json_cache()
 
-        if row_count != 1:
+        if user.id is None:
             raise Exception("Error inserting user")
         return user
 
-    def list_users(self) -> t.List[User]:
+    def list_users(self) -> t.Iterator[User]:
         return self.__dao.list_users()
\ No newline at end of file
@@ -1,9 +1,34 @@
 from __future__ import annotations
 
-import typing as t
+import zlib
 from http import HTTPStatus
+from typing import TYPE_CHECKING
 
-from flask import Response, jsonify, make_response
+import brotli
+import orjson
+from flask import Response, request, stream_with_context
+from flask.json.provider import JSONProvider
+
+if TYPE_CHECKING:
+    import typing as t
+
+
+class ORJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson, so `jsonify`, `request.get_json` and friends use it too.
+    Like Flask's default provider, non string keys are converted and unsupported types raise a TypeError
+    """
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: t.Any, **kwargs: t.Any) -> str:
+        return orjson.dumps(obj, option=self.option).decode("utf-8")
+
+    def loads(self, s: t.Union[str, bytes], **kwargs: t.Any) -> t.Any:
+        return orjson.loads(s)
+
+    def response(self, *args: t.Any, **kwargs: t.Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option), mimetype="application/json")
 
 
 def success_response(data: t.Union[dict, str]) -> Response:
@@ -11,4 +36,45 @@ def success_response(data: t.Union[dict, str]) -> Response:
 
 
 def response_with_status(data: t.Union[dict, str], status: int) -> Response:
-    return make_response(jsonify(data), status)
+    # serialize straight to bytes; non JSON types (e.g. exceptions) are rendered with str()
+    return json_bytes_response(orjson.dumps(data, default=str), status=status)
+
+
+def json_bytes_response(body: bytes, status: int = HTTPStatus.OK) -> Response:
+    return Response(body, status=status, mimetype="application/json")
+
+
+def json_stream_response(chunks: t.Iterable[bytes], status: int = HTTPStatus.OK) -> Response:
+    """
+    Streamed JSON response, compressed on the fly with br, or else gzip, when the client accepts it (the same
+    preference as COMPRESS_ALGORITHM)
+    """
+    encoding = None
+    if request.accept_encodings["br"]:
+        encoding, chunks = "br", _brotli_stream(chunks)
+    elif request.accept_encodings["gzip"]:
+        encoding, chunks = "gzip", _gzip_stream(chunks)
+
+    response = Response(stream_with_context(chunks), status=status, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _gzip_stream(chunks: t.Iterable[bytes]) -> t.Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)     # 16 + MAX_WBITS writes a gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks: t.Iterable[bytes]) -> t.Iterator[bytes]:
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=4)    # COMPRESS_BR_LEVEL default of Flask-Compress
+    for chunk in chunks:
+        compressed = compressor.process(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.finish()